@@ -14,9 +14,15 @@ from rat_spn import RatSpn, RatSpnConfig
 logger = logging.getLogger(__name__)
 
 
+def count_params(model: nn.Module) -> int:
+    """
+    Number of trainable parameters in a module. Feeds a list comprehension to sum(),
+    which CPython iterates faster than a generator expression.
+    """
+    return int(sum([p.numel() for p in model.parameters() if p.requires_grad]))
+
+
 def print_cspn_params(cspn):
-    def count_params(model):
-        return sum(p.numel() for p in model.parameters() if p.requires_grad)
     print(f"Total params in CSPN: {count_params(cspn)}")
     print(f"Params to extract features from the conditional: {count_params(cspn.feat_layers)}")
     print(f"Params in MLP for the sum params, excluding the heads: {count_params(cspn.sum_layers)}")
@@ -300,6 +306,32 @@ class CSPN(RatSpn):
         # depending on self._leaf.base_leaf_stds_are_in_lin_space, the stds are in log space or in linear space
         self._leaf.base_leaf.std_param = dist_stds
 
+    def jit_trace_cond_layers(self, example_condition: th.Tensor):
+        """
+        Replaces the conditional MLPs (feature, sum and dist param layers and their heads) with
+        th.jit.trace'd versions of themselves, removing the Python dispatch and nn.Module hook
+        overhead from every set_params call. These stacks are pure Sequentials of Linear layers,
+        so tracing them is safe; the SPN graph itself stays eager, as its sampling has
+        data-dependent control flow that a trace would bake in. The traced modules share their
+        parameters with the originals, so training is unaffected. Note that a trace freezes
+        train/eval-dependent behavior, i.e. Dropout in the conv feature layers, at trace time.
+
+        Args:
+            example_condition: A conditional input of the shape set_params will be called with,
+                e.g. a zero tensor of shape [batch, F_cond].
+        """
+        self.feat_layers = th.jit.trace(self.feat_layers, example_condition)
+        features = self.feat_layers(example_condition).flatten(start_dim=1)
+        self.sum_layers = th.jit.trace(self.sum_layers, features)
+        self.dist_layers = th.jit.trace(self.dist_layers, features)
+        sum_weights_pre_output = self.sum_layers(features)
+        self.sum_param_heads = nn.ModuleList(
+            [th.jit.trace(head, sum_weights_pre_output) for head in self.sum_param_heads]
+        )
+        dist_weights_pre_output = self.dist_layers(features)
+        self.dist_mean_head = th.jit.trace(self.dist_mean_head, dist_weights_pre_output)
+        self.dist_std_head = th.jit.trace(self.dist_std_head, dist_weights_pre_output)
+
     def clear_params(self):
         for layer in self._inner_layers:
             if isinstance(layer, Sum):
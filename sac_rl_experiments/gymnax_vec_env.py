@@ -0,0 +1,105 @@
+from typing import Any, List, Optional, Sequence, Type, Union
+
+import gym
+import numpy as np
+
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv, VecEnvIndices, VecEnvObs, VecEnvStepReturn
+
+
+class GymnaxVecEnv(VecEnv):
+    """
+    A VecEnv that steps a Gymnax environment on the accelerator instead of forking gym envs.
+    All num_envs environments are advanced by a single jax.jit-compiled call that vmaps
+    env.step over the batch, so there is no per-env Python work and no per-step process
+    communication. jax and gymnax are imported lazily; the rest of the code base does not
+    depend on them.
+
+    Observations are returned as numpy float32 arrays because stable-baselines3's replay
+    buffer stores numpy. Keeping them on-device (e.g. via dlpack) would require a
+    device-side replay buffer and is out of scope here.
+
+    :param env_name: A Gymnax environment ID, e.g. 'Pendulum-v1'
+    :param num_envs: Number of environments stepped in one batched call
+    :param seed: Seed of the PRNG key that all env randomness is derived from
+    """
+
+    def __init__(self, env_name: str, num_envs: int, seed: int = 0):
+        import jax
+        import gymnax
+
+        self._jax = jax
+        self._env, self._env_params = gymnax.make(env_name)
+
+        obs_space = self._env.observation_space(self._env_params)
+        act_space = self._env.action_space(self._env_params)
+        observation_space = gym.spaces.Box(
+            low=np.asarray(obs_space.low, dtype=np.float32),
+            high=np.asarray(obs_space.high, dtype=np.float32),
+            shape=obs_space.shape,
+            dtype=np.float32,
+        )
+        action_space = gym.spaces.Box(
+            low=np.asarray(act_space.low, dtype=np.float32),
+            high=np.asarray(act_space.high, dtype=np.float32),
+            shape=act_space.shape,
+            dtype=np.float32,
+        )
+        super(GymnaxVecEnv, self).__init__(
+            num_envs=num_envs, observation_space=observation_space, action_space=action_space
+        )
+
+        self._rng = jax.random.PRNGKey(seed)
+        # vmap over the per-env PRNG keys, states and actions; env params are shared.
+        self._reset_fn = jax.jit(jax.vmap(self._env.reset, in_axes=(0, None)))
+        self._step_fn = jax.jit(jax.vmap(self._env.step, in_axes=(0, 0, 0, None)))
+        self._state = None
+        self._actions = None
+
+    def _next_keys(self):
+        keys = self._jax.random.split(self._rng, self.num_envs + 1)
+        self._rng = keys[0]
+        return keys[1:]
+
+    def reset(self) -> VecEnvObs:
+        obs, self._state = self._reset_fn(self._next_keys(), self._env_params)
+        return np.asarray(obs, dtype=np.float32)
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self._actions = actions
+
+    def step_wait(self) -> VecEnvStepReturn:
+        obs, self._state, reward, done, _ = self._step_fn(
+            self._next_keys(), self._state, self._jax.numpy.asarray(self._actions), self._env_params
+        )
+        # Gymnax auto-resets inside step, so obs is already the first obs of the next episode
+        # where done is True.
+        infos = [{} for _ in range(self.num_envs)]
+        return (
+            np.asarray(obs, dtype=np.float32),
+            np.asarray(reward, dtype=np.float32),
+            np.asarray(done, dtype=bool),
+            infos,
+        )
+
+    def seed(self, seed: Optional[int] = None) -> List[Union[None, int]]:
+        if seed is not None:
+            self._rng = self._jax.random.PRNGKey(seed)
+        return [seed] * self.num_envs
+
+    def close(self) -> None:
+        pass
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> List[Any]:
+        return [getattr(self._env, attr_name)] * len(self._get_indices(indices))
+
+    def set_attr(self, attr_name: str, value: Any, indices: VecEnvIndices = None) -> None:
+        raise NotImplementedError("GymnaxVecEnv envs share one jitted step function, attrs cannot be set per env.")
+
+    def env_method(self, method_name: str, *method_args, indices: VecEnvIndices = None, **method_kwargs) -> List[Any]:
+        raise NotImplementedError("GymnaxVecEnv envs share one jitted step function, methods cannot be called per env.")
+
+    def env_is_wrapped(self, wrapper_class: Type[gym.Wrapper], indices: VecEnvIndices = None) -> List[bool]:
+        return [False] * len(self._get_indices(indices))
+
+    def get_images(self) -> Sequence[np.ndarray]:
+        raise NotImplementedError("GymnaxVecEnv does not support rendering.")
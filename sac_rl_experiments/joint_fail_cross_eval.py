@@ -58,6 +58,6 @@ if __name__ == "__main__":
             env_name='Ant-v3', num_envs=1, no_video=True, sample_failing_joints=True,
             sample_failures_every='step', save_interval=-1, seed=10,
             joint_fail_probs=list(np.linspace(args.min_fail_prob, args.max_fail_prob, args.fail_prob_steps)),
-            no_wandb=False,
+            no_wandb=False, normalize_obs=bool(experiment_config.get('train_normalize_obs', False)),
         )
         eval_over_joint_fail_probs(config, train_config=experiment_config)
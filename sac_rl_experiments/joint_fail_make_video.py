@@ -8,6 +8,8 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--model_path', '-m', type=str, required=True, help='Path to model to evaluate')
+    parser.add_argument('--normalize_obs', action='store_true',
+                        help='Set this if the model was trained with --normalize_obs.')
     args = parser.parse_args()
     assert os.path.exists(args.model_path)
     log_dir = os.path.split(os.path.split(args.model_path)[0])[0]
@@ -16,6 +18,6 @@ if __name__ == "__main__":
         log_dir=log_dir, proj_name='none', model_path=args.model_path, num_eval_ep=10,
         env_name='Ant-v3', num_envs=1, no_video=False, sample_failing_joints=False,
         sample_failures_every='episode', save_interval=1000, seed=10,
-        joint_fail_probs=[0.1], no_wandb=True,
+        joint_fail_probs=[0.1], no_wandb=True, normalize_obs=args.normalize_obs,
     )
     eval_over_joint_fail_probs(config, train_config=None)
@@ -1,8 +1,14 @@
 import re
 import os
+import json
+import multiprocessing
+import time
+import warnings
 import yaml
 import platform
+from pathlib import Path
 from typing import List, Dict
+import gym
 import numpy as np
 import torch as th
 import torch.nn as nn
@@ -10,19 +16,35 @@ import wandb
 from wandb.integration.sb3 import WandbCallback
 
 from stable_baselines3.common.torch_layers import NatureCNN, FlattenExtractor
-from stable_baselines3.common.vec_env import VecVideoRecorder
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecVideoRecorder
 from stable_baselines3.common.env_util import make_vec_env
-from stable_baselines3.common.logger import configure
 from stable_baselines3.common.evaluation import evaluate_policy
 
-from cspn import print_cspn_params
+from cspn import count_params, print_cspn_params
 from sac_rl_experiments.sb3 import EntropyLoggingSAC, CheckpointCallbackSaveReplayBuffer, \
-    CustomMlpPolicy, CspnPolicy, CspnActor
+    CustomMlpPolicy, CspnPolicy, CspnActor, PinnedReplayBuffer, SumTreeReplayBuffer, VideoRecorderCallback, \
+    configure_throttled_logger
 from utils import non_existing_folder_name
 from sac_rl_experiments.joint_failure_wrapper import wrap_in_float_and_joint_fail
+from sac_rl_experiments.shared_mem_vec_env import SharedMemVecEnv
 from dataclasses import dataclass
 
 
+def make_wandb_settings() -> 'wandb.Settings':
+    """System metrics are sampled and averaged coarsely so wandb bookkeeping stays off the step loop."""
+    return wandb.Settings(start_method='fork', _stats_sample_rate_seconds=15.0, _stats_samples_to_average=4)
+
+
+class BatchedWandbCallback(WandbCallback):
+    """
+    WandbCallback without any per-step work. Metrics reach wandb in batches through the
+    tensorboard event files, which sync_tensorboard consumes asynchronously; model
+    checkpoints are handled by CheckpointCallbackSaveReplayBuffer.
+    """
+    def _on_step(self) -> bool:
+        return True
+
+
 @dataclass
 class RunConfig:
     log_dir: str
@@ -65,6 +87,14 @@ class TrainConfig(RunConfig):
     total_timesteps: int
     run_id: str = None
     stop_after_nr_of_save_intervals: int = None
+    vec_env: str = 'auto'
+    train_freq: int = None
+    gradient_steps: int = -1
+    compile_policy: bool = False
+    jit_trace: bool = False
+    normalize_obs: bool = False
+    amp: str = 'fp32'
+    replay_buffer: str = 'uniform'
 
     @staticmethod
     def from_yaml(path: str):
@@ -79,6 +109,24 @@ class JointFailProbEvalConfig(RunConfig):
     model_path: str
     num_eval_ep: int
     joint_fail_probs: List
+    normalize_obs: bool = False
+
+
+def seed_run(seed: int, env=None) -> np.random.Generator:
+    """
+    Seeds everything a run draws randomness from. The env seed reaches the per-env PCG64
+    generators (see JointFailureWrapper.seed) even when the envs live in subprocesses,
+    which reseeding the driver's global numpy state never did. The legacy global state is
+    still seeded too, as stable-baselines3's replay buffers draw from it.
+    """
+    np.random.seed(seed)
+    th.manual_seed(seed)
+    th.cuda.manual_seed_all(seed)
+    if env is not None:
+        env.seed(seed)
+        env.action_space.seed(seed)
+        env.observation_space.seed(seed)
+    return np.random.default_rng(seed)
 
 
 def find_exp_dirs(parent_dir: str) -> List[str]:
@@ -116,6 +164,11 @@ def eval_over_joint_fail_probs(config: JointFailProbEvalConfig, train_config: Di
     if train_config is None:
         train_config = {}
 
+    if not config.normalize_obs and \
+            (train_config.get('normalize_obs') or train_config.get('train_normalize_obs')):
+        raise ValueError("The model was trained with normalize_obs, but the eval config does not set it. "
+                         "Evaluating on raw-scale observations would silently give wrong episode rewards.")
+
     if config.no_video:
         os.environ['LD_PRELOAD'] = os.environ.get('CONDA_PREFIX') + '/lib/libGLEW.so'
 
@@ -125,11 +178,10 @@ def eval_over_joint_fail_probs(config: JointFailProbEvalConfig, train_config: Di
     if not config.no_wandb:
         wandb.login(key=os.environ['WANDB_API_KEY'])
 
-    run_name = os.path.split(config.log_dir)[1]
-    monitor_path = os.path.join(config.log_dir, "joint_fail_prob_monitor")
-    video_path = os.path.join(config.log_dir, "video")
-    for d in [config.log_dir, monitor_path, video_path]:
-        os.makedirs(d, exist_ok=True)
+    log_dir = Path(config.log_dir)
+    run_name = log_dir.name
+    for sub in ["joint_fail_prob_monitor", "video"]:
+        (log_dir / sub).mkdir(parents=True, exist_ok=True)
 
     seed_regex = re.compile('_*s(|eed)[0-9]+')
     run_group = None
@@ -148,6 +200,7 @@ def eval_over_joint_fail_probs(config: JointFailProbEvalConfig, train_config: Di
             monitor_gym=True,
             reinit=True,
             force=True,
+            settings=make_wandb_settings(),
         )
         config.run_id = wandb_run.id
         wandb_run.config.update({
@@ -155,7 +208,7 @@ def eval_over_joint_fail_probs(config: JointFailProbEvalConfig, train_config: Di
             **train_config,
             'machine': platform.node(),
         })
-    config.to_yaml(os.path.join(config.log_dir, 'config.yaml'))
+    config.to_yaml(str(log_dir / 'config.yaml'))
 
     jf_prob_key = 'joint_fail_prob'
     ep_rew_prefix = 'ep_rew'
@@ -165,18 +218,38 @@ def eval_over_joint_fail_probs(config: JointFailProbEvalConfig, train_config: Di
         wandb.define_metric(ep_rew_prefix + '/*', step_metric=jf_prob_key)
         wandb.define_metric(ep_rew_prefix + '/*', step_metric=jf_prob_key)
 
-    for joint_fail_prob in config.joint_fail_probs:
-        env = create_joint_fail_env(
-            joint_fail_prob=joint_fail_prob, sample_failing_joints=config.sample_failing_joints,
-            sample_failures_every=config.sample_failures_every,
-            env_name=config.env_name, num_envs=config.num_envs, no_video=config.no_video, log_dir=config.log_dir,
-            save_interval=config.save_interval,
-        )
+    # The iterations only differ in the wrapper's failure probability, so the VecEnv (and its
+    # worker processes, if any) and the loaded model are built once and reused instead of
+    # re-forking and re-deserializing them per probability.
+    env = create_joint_fail_env(
+        joint_fail_prob=0.0, sample_failing_joints=config.sample_failing_joints,
+        sample_failures_every=config.sample_failures_every,
+        env_name=config.env_name, num_envs=config.num_envs, log_dir=config.log_dir,
+        normalize_obs=config.normalize_obs,
+    )
+    if config.normalize_obs:
+        # The model saw standardized observations during training, so the eval envs start
+        # from the statistics checkpointed next to the model instead of cold ones
+        model_dir = os.path.dirname(config.model_path)
+        stats_file = [p for p in os.listdir(model_dir) if p.startswith('obs_norm_stats')]
+        if stats_file:
+            stats = np.load(os.path.join(model_dir, stats_file[0]))
+            # All training envs converge to the same statistics; the first env's are used
+            env.env_method('set_obs_norm_stats', stats['mean'][0], stats['var'][0], float(stats['count'][0]))
+        else:
+            warnings.warn("No saved observation normalization statistics found next to the model, "
+                          "the eval envs start with cold running statistics.")
+    if not config.no_video:
+        # Without env as a VecVideoRecorder we need the env var LD_PRELOAD=$CONDA_PREFIX/lib/libGLEW.so
+        env = VecVideoRecorder(env, video_folder=str(log_dir / 'video'),
+                               record_video_trigger=lambda x: x % config.save_interval == 0,
+                               video_length=1000)
+    model = EntropyLoggingSAC.load(config.model_path, env)
 
-        model = EntropyLoggingSAC.load(config.model_path, env)
+    for joint_fail_prob in config.joint_fail_probs:
+        env.env_method('set_joint_failure_prob', joint_fail_prob)
 
-        np.random.seed(config.seed)
-        th.manual_seed(config.seed)
+        seed_run(config.seed, env)
 
         ep_rews, ep_lens = evaluate_policy(model=model, env=env, n_eval_episodes=config.num_eval_ep,
                                            return_episode_rewards=True)
@@ -206,31 +279,124 @@ def get_max_step_from_sb3_model_checkpoints(model_path):
         return None
 
 
+def resolve_vec_env_cls(vec_env: str):
+    """Maps a vec_env choice to a VecEnv class and its kwargs."""
+    if vec_env == 'subproc':
+        return SubprocVecEnv, {'start_method': 'fork'}
+    elif vec_env == 'shm':
+        return SharedMemVecEnv, {'start_method': 'fork'}
+    elif vec_env == 'dummy':
+        return DummyVecEnv, None
+    else:
+        raise ValueError(f"vec_env {vec_env} unknown!")
+
+
 def create_joint_fail_env(
-        joint_fail_prob: float, sample_failing_joints: bool, env_name: str, num_envs: int, no_video: bool,
-        sample_failures_every: str, log_dir: str, save_interval: int,
+        joint_fail_prob: float, sample_failing_joints: bool, env_name: str, num_envs: int,
+        sample_failures_every: str, log_dir: str, vec_env: str = 'dummy', normalize_obs: bool = False,
 ):
+    if vec_env == 'gymnax':
+        # The joint failure wrappers run on the gym side and cannot be jitted into a Gymnax step.
+        assert joint_fail_prob == 0.0 and not sample_failing_joints, \
+            "The gymnax backend only supports runs without joint failures."
+        assert not normalize_obs, "The gymnax backend does not support normalize_obs."
+        from sac_rl_experiments.gymnax_vec_env import GymnaxVecEnv
+        return GymnaxVecEnv(env_name=env_name, num_envs=num_envs)
     joint_fail_kwargs = {'joint_failure_prob': joint_fail_prob,
                          'sample_failing_joints': sample_failing_joints,
-                         'sample_failures_every': sample_failures_every}
+                         'sample_failures_every': sample_failures_every,
+                         'normalize_obs': normalize_obs}
+    if vec_env == 'auto':
+        if num_envs == 1:
+            # Nothing to parallelize, the in-process backend always wins
+            vec_env = 'dummy'
+        else:
+            # log_dir is unique per run; the cache lives in the shared parent so sweeps reuse it
+            vec_env = pick_fastest_vec_env(env_name=env_name, num_envs=num_envs,
+                                           joint_fail_kwargs=joint_fail_kwargs,
+                                           cache_dir=os.path.dirname(log_dir))
+    vec_env_cls, vec_env_kwargs = resolve_vec_env_cls(vec_env)
     env = make_vec_env(
         env_id=env_name,
         n_envs=num_envs,
         monitor_dir=os.path.join(log_dir, 'monitor'),
         wrapper_class=wrap_in_float_and_joint_fail,
         wrapper_kwargs=joint_fail_kwargs,
-        # vec_env_cls=SubprocVecEnv,
-        # vec_env_kwargs={'start_method': 'fork'},
+        vec_env_cls=vec_env_cls,
+        vec_env_kwargs=vec_env_kwargs,
     )
-
-    if not no_video:
-        # Without env as a VecVideoRecorder we need the env var LD_PRELOAD=$CONDA_PREFIX/lib/libGLEW.so
-        env = VecVideoRecorder(env, video_folder=os.path.join(log_dir, 'video'),
-                               record_video_trigger=lambda x: x % save_interval == 0,
-                               video_length=1000)
     return env
 
 
+def probe_vec_env_fps(vec_env_cls, vec_env_kwargs, make_fn, num_envs: int, steps: int = 500) -> float:
+    """Builds a VecEnv, steps it with random actions and returns the measured steps per second."""
+    env = vec_env_cls([make_fn] * num_envs, **(vec_env_kwargs or {}))
+    try:
+        env.reset()
+        actions = np.stack([env.action_space.sample() for _ in range(num_envs)])
+        start = time.perf_counter()
+        for _ in range(steps):
+            env.step(actions)
+        elapsed = time.perf_counter() - start
+    finally:
+        env.close()
+    return steps * num_envs / elapsed
+
+
+def pick_fastest_vec_env(env_name: str, num_envs: int, joint_fail_kwargs: dict, cache_dir: str,
+                         probe_steps: int = 500) -> str:
+    """
+    Times the dummy, subproc and shm backends on the actual env and returns the fastest.
+    Whether in-process or subprocess stepping wins depends on how expensive a single env
+    step is relative to the transport overhead, so it is measured instead of guessed.
+    The winner is cached per (env_name, num_envs, machine), so only the first run of a
+    sweep pays the probe cost.
+    """
+    cache_path = os.path.join(cache_dir, '.vec_choice.json')
+    cache_key = f"{env_name}_{num_envs}_{platform.node()}"
+    cache = {}
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            # e.g. a parallel seed process is writing the cache right now; probing is always safe
+            cache = {}
+    if cache_key in cache:
+        return cache[cache_key]
+
+    def make_fn():
+        return wrap_in_float_and_joint_fail(gym.make(env_name), **joint_fail_kwargs)
+
+    fps = {}
+    for choice in ['dummy', 'subproc', 'shm']:
+        vec_env_cls, vec_env_kwargs = resolve_vec_env_cls(choice)
+        fps[choice] = probe_vec_env_fps(vec_env_cls, vec_env_kwargs, make_fn, num_envs, steps=probe_steps)
+    winner = max(fps, key=fps.get)
+    print(f"vec_env probe ({num_envs} envs): "
+          + ", ".join(f"{choice}: {f:.0f} FPS" for choice, f in fps.items())
+          + f" -> using {winner}")
+    cache[cache_key] = winner
+    # Written atomically, so concurrent readers never see a half-written file
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)
+    return winner
+
+
+def create_video_eval_env(joint_fail_prob: float, sample_failing_joints: bool, sample_failures_every: str,
+                          env_name: str, normalize_obs: bool = False):
+    """A single-env DummyVecEnv, wrapped like the training envs, that is only stepped for video recording."""
+    def make_env():
+        return wrap_in_float_and_joint_fail(
+            gym.make(env_name), joint_failure_prob=joint_fail_prob,
+            sample_failing_joints=sample_failing_joints, sample_failures_every=sample_failures_every,
+            normalize_obs=normalize_obs,
+        )
+    return DummyVecEnv([make_env])
+
+
 def train_joint_fail_sac(config: TrainConfig):
     assert os.environ.get('LD_PRELOAD') is None, "The LD_PRELOAD environment variable may not be set externally."
     if config.no_video:
@@ -245,12 +411,10 @@ def train_joint_fail_sac(config: TrainConfig):
     if not config.no_wandb:
         wandb.login(key=os.environ['WANDB_API_KEY'])
 
-    run_name = os.path.split(config.log_dir)[1]
-    monitor_path = os.path.join(config.log_dir, "monitor")
-    model_path = os.path.join(config.log_dir, "models")
-    video_path = os.path.join(config.log_dir, "video")
-    for d in [config.log_dir, monitor_path, model_path, video_path]:
-        os.makedirs(d, exist_ok=True)
+    log_dir = Path(config.log_dir)
+    run_name = log_dir.name
+    for sub in ["monitor", "models", "video"]:
+        (log_dir / sub).mkdir(parents=True, exist_ok=True)
 
     run = None
     if config.run_id is not None:
@@ -263,6 +427,7 @@ def train_joint_fail_sac(config: TrainConfig):
             monitor_gym=True,
             reinit=True,
             force=True,
+            settings=make_wandb_settings(),
         )
     elif not config.no_wandb:
         seed_regex = re.compile('_*s(|eed)[0-9]+')
@@ -279,6 +444,7 @@ def train_joint_fail_sac(config: TrainConfig):
             monitor_gym=True,
             reinit=True,
             force=True,
+            settings=make_wandb_settings(),
         )
         config.run_id = run.id
         run.config.update({
@@ -286,16 +452,32 @@ def train_joint_fail_sac(config: TrainConfig):
             'machine': platform.node(),
         })
 
-    config.to_yaml(os.path.join(config.log_dir, 'config.yaml'))
+    config.to_yaml(str(log_dir / 'config.yaml'))
 
     env = create_joint_fail_env(
         joint_fail_prob=config.joint_fail_prob, sample_failing_joints=config.sample_failing_joints,
         sample_failures_every=config.sample_failures_every,
-        env_name=config.env_name, num_envs=config.num_envs, no_video=config.no_video, log_dir=config.log_dir,
-        save_interval=config.save_interval,
+        env_name=config.env_name, num_envs=config.num_envs, log_dir=config.log_dir,
+        vec_env=config.vec_env, normalize_obs=config.normalize_obs,
     )
 
-    model_path = os.path.join(config.log_dir, 'models')
+    # Videos are recorded on a separate single env so the training env never renders
+    video_recorder_callback = None
+    if not config.no_video:
+        # The video eval env is a gym env with the joint failure wrappers, whose obs carry
+        # failure info a model trained on the bare gymnax observation space cannot consume.
+        assert config.vec_env != 'gymnax', "The gymnax backend requires --no_video."
+        video_eval_env = create_video_eval_env(
+            joint_fail_prob=config.joint_fail_prob, sample_failing_joints=config.sample_failing_joints,
+            sample_failures_every=config.sample_failures_every, env_name=config.env_name,
+            normalize_obs=config.normalize_obs,
+        )
+        video_recorder_callback = VideoRecorderCallback(
+            eval_env=video_eval_env, video_folder=str(log_dir / 'video'),
+            render_freq=config.save_interval, video_length=1000, sync_obs_norm=config.normalize_obs,
+        )
+
+    model_path = str(log_dir / 'models')
     if os.path.exists(model_path) and \
             (last_saved_step := get_max_step_from_sb3_model_checkpoints(model_path)) is not None:
         print(f"Continuing from step {last_saved_step}")
@@ -311,6 +493,18 @@ def train_joint_fail_sac(config: TrainConfig):
         assert len(replay_buffer) > 0
         replay_buffer = os.path.join(model_path, replay_buffer[0])
         model.load_replay_buffer(replay_buffer)
+        if config.normalize_obs:
+            # Without the saved statistics the policy would see near-raw-scale observations
+            # until the restarted running mean and variance re-converge
+            stats_file = [p for p in files_of_last_saved_step if p.startswith('obs_norm_stats')]
+            if stats_file:
+                stats = np.load(os.path.join(model_path, stats_file[0]))
+                for idx in range(env.num_envs):
+                    env.env_method('set_obs_norm_stats', stats['mean'][idx], stats['var'][idx],
+                                   float(stats['count'][idx]), indices=idx)
+            else:
+                warnings.warn("Resuming a normalize_obs run without saved normalization statistics, "
+                              "the running mean and variance restart from scratch.")
     else:
         sac_kwargs = {
             'env': env,
@@ -321,6 +515,13 @@ def train_joint_fail_sac(config: TrainConfig):
             'device': config.device,
             'learning_rate': config.learning_rate,
             'buffer_size': config.buffer_size,
+            'replay_buffer_class': SumTreeReplayBuffer if config.replay_buffer == 'sumtree' else PinnedReplayBuffer,
+            # One batched update per env transition: with N parallel envs this replaces N
+            # single updates by one update of N gradient steps, saving Python and kernel
+            # launch overhead. gradient_steps=-1 means "as many steps as transitions collected".
+            'train_freq': config.train_freq if config.train_freq is not None else max(1, config.num_envs),
+            'gradient_steps': config.gradient_steps,
+            'amp_dtype': config.amp,
         }
         cspn_args = {
             'R': config.repetitions,
@@ -338,47 +539,84 @@ def train_joint_fail_sac(config: TrainConfig):
         }
         sac_kwargs['policy_kwargs'] = {
             'actor_cspn_args': cspn_args,
-            'joint_failure_info_in_obs': True,
+            # The gymnax backend runs without the joint failure wrappers, so its obs carry no failure info
+            'joint_failure_info_in_obs': config.vec_env != 'gymnax',
             'features_extractor_class': NatureCNN if len(env.observation_space.shape) > 1 else FlattenExtractor,
         }
         if run is not None:
             run.config.update(sac_kwargs)
         model = EntropyLoggingSAC(policy=CustomMlpPolicy if config.mlp_actor else CspnPolicy, **sac_kwargs)
 
+    if isinstance(getattr(model.actor, 'features_extractor', None), NatureCNN):
+        # With channels-last conv weights, cuDNN dispatches its NHWC Tensor Core kernels
+        # directly instead of permuting around every conv; benchmark mode lets it pick the
+        # best algorithm once for the fixed observation shape.
+        th.backends.cudnn.benchmark = True
+        model.actor.features_extractor.to(memory_format=th.channels_last)
+        model.critic.features_extractor.to(memory_format=th.channels_last)
+        model.critic_target.features_extractor.to(memory_format=th.channels_last)
+
+    if config.jit_trace:
+        if isinstance(model.actor, CspnActor):
+            # set_params is called with batch size num_envs during rollout and batch_size during
+            # training; the trace of the pure-MLP conditional layers generalizes over both.
+            dummy_condition = th.zeros(config.num_envs, model.actor.features_dim, device=model.device)
+            model.actor.cspn.jit_trace_cond_layers(dummy_condition)
+        else:
+            warnings.warn("jit_trace only applies to the CSPN actor, continuing with the eager policy.")
+
+    if config.compile_policy:
+        if hasattr(th, 'compile'):
+            # reduce-overhead captures CUDA graphs, a good fit for the fixed-shape rollout batches.
+            # Only the bound forward methods are compiled: wrapping the modules themselves
+            # would prefix every policy.state_dict() key with _orig_mod. and make the saved
+            # checkpoints unloadable by EntropyLoggingSAC.load.
+            model.actor.forward = th.compile(model.actor.forward, mode='reduce-overhead', fullgraph=False)
+            model.critic.forward = th.compile(model.critic.forward, mode='reduce-overhead', fullgraph=False)
+            # Trigger compilation outside the timed training loop
+            model.predict(model.observation_space.sample()[None], deterministic=True)
+        else:
+            warnings.warn("compile_policy requires torch >= 2.0, continuing with the eager policy.")
+
     train_model(
         model=model, seed=config.seed, total_timesteps=config.total_timesteps, log_dir=config.log_dir,
         save_interval_steps=config.save_interval, log_interval_episodes=config.log_interval, wandb_run=run,
         stop_after_nr_of_save_intervals=config.stop_after_nr_of_save_intervals,
+        video_recorder_callback=video_recorder_callback, save_obs_norm_stats=config.normalize_obs,
     )
 
 
 def train_model(
         model: EntropyLoggingSAC, seed: int, total_timesteps: int, log_dir: str, save_interval_steps: int,
         stop_after_nr_of_save_intervals: int = None, log_interval_episodes: int = 4, wandb_run=None,
+        video_recorder_callback: VideoRecorderCallback = None, save_obs_norm_stats: bool = False,
 ):
     if total_timesteps - model.num_timesteps <= 0:
         print("Model has already reached its total timesteps.")
     else:
-        np.random.seed(seed)
-        th.manual_seed(seed)
+        seed_run(seed, model.get_env())
 
-        run_name = os.path.split(log_dir)[1]
-        model_path = os.path.join(log_dir, "models")
+        run_name = Path(log_dir).name
+        model_path = str(Path(log_dir) / "models")
         callback = [CheckpointCallbackSaveReplayBuffer(
             save_freq=save_interval_steps,
             save_path=model_path,
             name_prefix=run_name,
             stop_after_nr_of_saves=stop_after_nr_of_save_intervals,
+            save_obs_norm_stats=save_obs_norm_stats,
         )]
+        if video_recorder_callback is not None:
+            callback.append(video_recorder_callback)
         if wandb_run is not None:
-            callback.append(WandbCallback(
+            callback.append(BatchedWandbCallback(
                 # gradient_save_freq=10000,
                 # model_save_path=model_path,
                 # model_save_freq=save_interval,
                 verbose=2,
             ))
 
-        logger = configure(log_dir, ["stdout", "csv", "tensorboard"])
+        # csv and tensorboard receive every dump; the pretty-printed stdout table only every 100th
+        logger = configure_throttled_logger(log_dir, ["stdout", "csv", "tensorboard"], stdout_every=100)
         logger.output_formats[0].max_length = 50
         model.set_logger(logger)
 
@@ -387,7 +625,7 @@ def train_model(
         if isinstance(model.actor, CspnActor):
             print_cspn_params(model.actor.cspn)
         else:
-            print(f"Actor MLP has {sum(p.numel() for p in model.actor.parameters() if p.requires_grad)} parameters.")
+            print(f"Actor MLP has {count_params(model.actor)} parameters.")
         # noinspection PyTypeChecker
         model.learn(
             total_timesteps=total_timesteps - model.num_timesteps,
@@ -409,8 +647,17 @@ if __name__ == "__main__":
     parser.add_argument('--config', '-c', type=str,
                         help='Path to an existing config. If provided, all other arguments will be ignored.')
     parser.add_argument('--seeds', '-s', type=int, nargs='+')
+    parser.add_argument('--parallel_seeds', action='store_true',
+                        help='Train all seeds at the same time, one process per seed, instead of serially.')
     parser.add_argument('--mlp_actor', action='store_true', help='Use a MLP actor')
     parser.add_argument('--num_envs', type=int, default=1, help='Number of parallel environments to run.')
+    parser.add_argument('--vec_env', type=str, default='auto', choices=['auto', 'dummy', 'subproc', 'shm', 'gymnax'],
+                        help='VecEnv backend. dummy steps envs sequentially in-process, subproc forks one '
+                             'worker process per env, shm is subproc with observations passed through shared '
+                             'memory instead of pipes. auto times dummy, subproc and shm on the actual env '
+                             'when num_envs > 1 and picks the fastest (cached per machine). gymnax steps all '
+                             'envs in one jitted JAX call (requires gymnax, only for runs without joint '
+                             'failures).')
     parser.add_argument('--total_timesteps', '-ts', type=int, default=int(1e6), help='Total timesteps to train model.')
     parser.add_argument('--save_interval', type=int, help='Save model and a video every save_interval timesteps.')
     parser.add_argument('--stop_after_nr_of_save_intervals', type=int, default=None,
@@ -425,17 +672,36 @@ if __name__ == "__main__":
                         help='Directory to save logs to.')
     parser.add_argument('--no_wandb', action='store_true', help="Don't log this run in WandB")
     parser.add_argument('--no_video', action='store_true', help="Don't record videos of the agent.")
+    parser.add_argument('--compile_policy', action='store_true',
+                        help='Wrap actor and critic in torch.compile (requires torch >= 2.0).')
+    parser.add_argument('--jit_trace', action='store_true',
+                        help="Replace the CSPN's conditional MLPs with torch.jit-traced versions.")
+    parser.add_argument('--amp', type=str, default='fp32', choices=['fp32', 'bf16'],
+                        help='Run the forward passes of SAC updates in bfloat16 autocast. '
+                             'Requires a GPU with bf16 support (Ampere or newer).')
     # SAC arguments
     parser.add_argument('--ent_coef', type=float, default=0.1, help='Entropy temperature')
     parser.add_argument('--learning_rate', '-lr', type=float, default=3e-4, help='Learning rate')
     parser.add_argument('--learning_starts', type=int, default=1000,
                         help='Nr. of steps to act randomly in the beginning.')
     parser.add_argument('--buffer_size', type=int, default=1_000_000, help='replay buffer size')
+    parser.add_argument('--replay_buffer', type=str, default='uniform', choices=['uniform', 'sumtree'],
+                        help='sumtree keeps a segment tree over transition priorities for O(log N) '
+                             'prioritized sampling. Samples uniformly until priorities are updated.')
+    parser.add_argument('--train_freq', type=int, default=None,
+                        help='Update the model every train_freq env steps. Defaults to num_envs, trading a bit of '
+                             'sample efficiency for fewer, larger update calls.')
+    parser.add_argument('--gradient_steps', type=int, default=-1,
+                        help='Gradient steps per update. -1 matches the number of transitions collected '
+                             'since the last update.')
     parser.add_argument('--joint_fail_prob', '-jf', type=float, default=0.05,
                         help="Joints can fail with this probability")
     parser.add_argument('--sample_failing_joints', action='store_true', help="Sample replacements for failing joints")
     parser.add_argument('--sample_failures_every', type=str, default='step', choices=['step', 'episode'],
                         help='When to sample joint failures.')
+    parser.add_argument('--normalize_obs', action='store_true',
+                        help='Standardize observations with running statistics inside each env worker. '
+                             'The appended joint failure info is not rescaled.')
     # CSPN arguments
     parser.add_argument('--repetitions', '-R', type=int, default=3, help='Number of parallel CSPNs to learn at once. ')
     parser.add_argument('--cspn_depth', '-D', type=int,
@@ -464,11 +730,27 @@ if __name__ == "__main__":
         kwargs = vars(args)
         seeds = kwargs.pop('seeds')
         run_name = kwargs.pop('run_name')
+        parallel_seeds = kwargs.pop('parallel_seeds')
         kwargs.pop('config')
+        run_name = f"{'MLP' if args.mlp_actor else 'CSPN'}_{run_name}"
+        base_dir = Path(args.log_dir) / args.proj_name
+        configs = []
         for seed in seeds:
-            run_name = f"{'MLP' if args.mlp_actor else 'CSPN'}_{run_name}"
             run_name_seed = f"{run_name}_s{seed}"
-            log_dir = os.path.join(args.log_dir, args.proj_name)
-            log_dir = os.path.join(log_dir, non_existing_folder_name(log_dir, run_name_seed))
-            kwargs['log_dir'] = log_dir
-            train_joint_fail_sac(TrainConfig(seed=seed, **kwargs))
+            log_dir = base_dir / non_existing_folder_name(str(base_dir), run_name_seed)
+            configs.append(TrainConfig(seed=seed, **{**kwargs, 'log_dir': str(log_dir)}))
+        if parallel_seeds and len(configs) > 1:
+            # Seeds are independent, so train them all at once instead of leaving the GPU
+            # half-idle for the length of a serial sweep. spawn (not fork), so that every
+            # trainer initializes its own CUDA context.
+            ctx = multiprocessing.get_context('spawn')
+            processes = [ctx.Process(target=train_joint_fail_sac, args=(config,)) for config in configs]
+            for p in processes:
+                p.start()
+            for p in processes:
+                p.join()
+            if any(p.exitcode != 0 for p in processes):
+                raise RuntimeError(f"Seed runs exited with codes {[p.exitcode for p in processes]}")
+        else:
+            for config in configs:
+                train_joint_fail_sac(config)
@@ -2,12 +2,58 @@ import gym
 import numpy as np
 
 
-def wrap_in_float_and_joint_fail(env, **kwargs):
+def wrap_in_float_and_joint_fail(env, normalize_obs: bool = False, **kwargs):
+    if normalize_obs:
+        # Must wrap the bare env: the joint failure info appended further out may not be rescaled
+        env = NormalizeObservation(env)
     env = JointFailureWrapper(env, **kwargs)
     env = FloatWrapper(env)
     return env
 
 
+class RunningMeanStd:
+    """Running mean and variance over single observations, updated with Welford's algorithm."""
+    def __init__(self, shape, epsilon: float = 1e-4):
+        self.mean = np.zeros(shape, dtype=np.float64)
+        self.var = np.ones(shape, dtype=np.float64)
+        self.count = epsilon
+
+    def update(self, x: np.ndarray):
+        self.count += 1
+        delta = x - self.mean
+        self.mean = self.mean + delta / self.count
+        self.var = self.var + (delta * (x - self.mean) - self.var) / self.count
+
+
+class NormalizeObservation(gym.ObservationWrapper):
+    """
+    Standardizes observations with running statistics once at the source, inside the env
+    worker, instead of every network forward re-processing raw observations. Must sit below
+    JointFailureWrapper so that the appended failure info stays untouched - the actor reads
+    it as 0/1 flags and raw replacement actions.
+    """
+    def __init__(self, env, epsilon: float = 1e-8):
+        super(NormalizeObservation, self).__init__(env)
+        self._obs_rms = RunningMeanStd(self.observation_space.shape)
+        self._epsilon = epsilon
+        self.observation_space = gym.spaces.Box(
+            low=-np.inf, high=np.inf, shape=self.observation_space.shape, dtype=self.observation_space.dtype
+        )
+
+    def get_obs_norm_stats(self):
+        """The running statistics, reachable through VecEnv.env_method so they can be checkpointed."""
+        return self._obs_rms.mean, self._obs_rms.var, self._obs_rms.count
+
+    def set_obs_norm_stats(self, mean: np.ndarray, var: np.ndarray, count: float):
+        self._obs_rms.mean = np.asarray(mean, dtype=np.float64)
+        self._obs_rms.var = np.asarray(var, dtype=np.float64)
+        self._obs_rms.count = count
+
+    def observation(self, obs):
+        self._obs_rms.update(obs)
+        return (obs - self._obs_rms.mean) / np.sqrt(self._obs_rms.var + self._epsilon)
+
+
 class JointFailureWrapper(gym.Wrapper):
     """
     A wrapper for gym environments that lets joint fail with a certain probability.
@@ -20,6 +66,9 @@ class JointFailureWrapper(gym.Wrapper):
     """
     def __init__(self, env, joint_failure_prob: float, sample_failing_joints: bool, sample_failures_every: str):
         super().__init__(env)
+        # A per-env PCG64 generator: faster per draw than the global legacy MT19937 state
+        # and independent of whatever else draws from np.random
+        self._rng = np.random.default_rng()
         self._next_joint_failure = np.hstack((np.zeros(self.action_space.shape), np.zeros(self.action_space.shape)))
         self.joint_failure_prob = joint_failure_prob
         self.sample_failing_joints = sample_failing_joints
@@ -38,13 +87,21 @@ class JointFailureWrapper(gym.Wrapper):
         ))
         self.observation_space = gym.spaces.Box(low=new_low, high=new_high, dtype=np.float64)
 
+    def set_joint_failure_prob(self, joint_failure_prob: float):
+        """Setter that can be called through VecEnv.env_method to reuse an env across eval runs."""
+        self.joint_failure_prob = joint_failure_prob
+
+    def seed(self, seed=None):
+        self._rng = np.random.default_rng(seed)
+        return super(JointFailureWrapper, self).seed(seed)
+
     def sample_joint_failures(self):
-        failing_joints = (np.random.random_sample(self.action_space.shape) < self.joint_failure_prob)
+        failing_joints = (self._rng.random(self.action_space.shape) < self.joint_failure_prob)
         failing_joints = failing_joints.astype(self.observation_space.dtype)
         low = self.action_space.low
         high = self.action_space.high
         if self.sample_failing_joints:
-            action_replacement = low + np.random.random_sample(self.action_space.shape) * (high - low)
+            action_replacement = low + self._rng.random(self.action_space.shape) * (high - low)
             action_replacement = action_replacement * failing_joints
         else:
             action_replacement = np.zeros(self.action_space.shape)
@@ -69,12 +126,24 @@ class JointFailureWrapper(gym.Wrapper):
         return np.hstack((observation, self._next_joint_failure))
 
 
-class FloatWrapper(gym.Wrapper):
+class FloatWrapper(gym.ObservationWrapper):
+    """
+    Casts observations to float32 at the source, so that envs emit float32 directly instead of
+    the driver casting float64 observations on every step (and shipping twice the bytes through
+    the VecEnv pipes when subprocesses are used).
+    """
     def __init__(self, *args, **kwargs):
         super(FloatWrapper, self).__init__(*args, **kwargs)
         self.observation_space = gym.spaces.Box(
-            low=self.observation_space.low, high=self.observation_space.high, dtype=np.float32
+            low=self.observation_space.low.astype(np.float32),
+            high=self.observation_space.high.astype(np.float32),
+            dtype=np.float32,
         )
         self.action_space = gym.spaces.Box(
-            low=self.action_space.low, high=self.action_space.high, dtype=np.float32
+            low=self.action_space.low.astype(np.float32),
+            high=self.action_space.high.astype(np.float32),
+            dtype=np.float32,
         )
+
+    def observation(self, obs):
+        return obs.astype(np.float32, copy=False)
@@ -1,4 +1,5 @@
 import os
+from stable_baselines3.common.buffers import ReplayBuffer
 from stable_baselines3.sac.policies import SACPolicy
 from stable_baselines3.sac.sac import SAC
 from stable_baselines3.common.utils import polyak_update
@@ -9,7 +10,10 @@ from stable_baselines3.common.torch_layers import (
 )
 from stable_baselines3.common.off_policy_algorithm import OffPolicyAlgorithm
 from stable_baselines3.common.callbacks import BaseCallback, CheckpointCallback
+from stable_baselines3.common.logger import DISABLED, KVWriter, Logger, make_output_format
+from stable_baselines3.common.vec_env import VecEnv, VecVideoRecorder
 import warnings
+from contextlib import nullcontext
 from typing import List, Tuple
 
 import gym
@@ -26,6 +30,78 @@ LOG_STD_MAX = 2
 LOG_STD_MIN = -20
 
 
+class PinnedReplayBuffer(ReplayBuffer):
+    """
+    Replay buffer that stages sampled batches in pinned (page-locked) host memory before
+    copying them to the GPU. Pinned memory allows the H2D copy to run asynchronously, so the
+    transfer of a batch overlaps with the preceding gradient step instead of stalling the
+    CUDA stream. Behaves like the regular ReplayBuffer on CPU devices.
+    """
+
+    def to_torch(self, array: np.ndarray, copy: bool = True) -> th.Tensor:
+        if self.device.type != 'cuda':
+            return super(PinnedReplayBuffer, self).to_torch(array, copy=copy)
+        # pin_memory() always copies the array into a fresh page-locked buffer,
+        # so the copy flag is satisfied either way.
+        return th.as_tensor(array).pin_memory().to(self.device, non_blocking=True)
+
+
+class SumTreeReplayBuffer(PinnedReplayBuffer):
+    """
+    Replay buffer that keeps a numpy segment tree (sum tree) over per-row priorities, so
+    drawing a batch proportional to priority costs O(log N) per sample instead of the O(N)
+    prefix-sum scan of a naive prioritized buffer. New transitions enter with the running
+    max priority, so as long as update_priorities() is never called, sampling stays uniform
+    and the buffer behaves like its parent class.
+
+    Priorities are tracked per buffer row; with n_envs > 1, the n_envs transitions stored
+    in one row share a priority.
+    """
+
+    def __init__(self, buffer_size: int, observation_space, action_space, **kwargs):
+        super(SumTreeReplayBuffer, self).__init__(buffer_size, observation_space, action_space, **kwargs)
+        assert not self.optimize_memory_usage, "SumTreeReplayBuffer does not support optimize_memory_usage."
+        # A power-of-two leaf count puts all leaves at the same tree depth, which lets the
+        # descent below run as batched numpy ops, one level at a time.
+        self._tree_capacity = 1
+        while self._tree_capacity < self.buffer_size:
+            self._tree_capacity *= 2
+        self.tree = np.zeros(2 * self._tree_capacity, dtype=np.float64)
+        self._max_priority = 1.0
+
+    def add(self, obs, next_obs, action, reward, done, infos) -> None:
+        row = self.pos
+        super(SumTreeReplayBuffer, self).add(obs, next_obs, action, reward, done, infos)
+        self.update_priorities(np.array([row]), np.array([self._max_priority]))
+
+    def update_priorities(self, row_indices: np.ndarray, priorities: np.ndarray) -> None:
+        self._max_priority = max(self._max_priority, float(np.max(priorities)))
+        leaves = row_indices + self._tree_capacity
+        self.tree[leaves] = priorities
+        # Walk all touched parents up to the root, one tree level per iteration
+        parents = np.unique(leaves // 2)
+        while parents[0] >= 1:
+            self.tree[parents] = self.tree[2 * parents] + self.tree[2 * parents + 1]
+            parents = np.unique(parents // 2)
+
+    def sample(self, batch_size: int, env=None):
+        total_priority = self.tree[1]
+        if total_priority <= 0.0:
+            return super(SumTreeReplayBuffer, self).sample(batch_size, env=env)
+        x = np.random.uniform(0.0, total_priority, size=batch_size)
+        idx = np.ones(batch_size, dtype=np.int64)
+        while idx[0] < self._tree_capacity:
+            left = 2 * idx
+            left_sums = self.tree[left]
+            go_right = x > left_sums
+            x = np.where(go_right, x - left_sums, x)
+            idx = np.where(go_right, left + 1, left)
+        # Rounding errors in the descent could land on an empty leaf at the very edge
+        upper_bound = self.buffer_size if self.full else self.pos
+        batch_inds = np.minimum(idx - self._tree_capacity, upper_bound - 1)
+        return self._get_samples(batch_inds, env=env)
+
+
 class CspnActor(BasePolicy):
     """
     Actor network (policy) for SAC.
@@ -232,10 +308,21 @@ class CustomMlpPolicy(SACPolicy):
 class EntropyLoggingSAC(SAC):
     """
     Soft Actor-Critic (SAC) modified for a CSPN actor
+
+    :param amp_dtype: 'fp32' trains everything in full precision. 'bf16' wraps the forward
+        passes of train() in a bfloat16 autocast; bf16 shares the fp32 exponent range, so no
+        loss scaling is needed. Parameters, optimizer state and log_ent_coef stay fp32.
     """
-    def __init__(self, **kwargs):
+    def __init__(self, amp_dtype: str = 'fp32', **kwargs):
+        assert amp_dtype in ['fp32', 'bf16']
+        self.amp_dtype = amp_dtype
         super(EntropyLoggingSAC, self).__init__(**kwargs)
 
+    def _amp_autocast(self):
+        if self.amp_dtype == 'bf16':
+            return th.autocast(device_type=self.device.type, dtype=th.bfloat16)
+        return nullcontext()
+
     def learn(self, tb_log_name=None, callback=None, **kwargs) -> OffPolicyAlgorithm:
         if tb_log_name is None:
             tb_log_name = 'CspnSAC'
@@ -273,10 +360,12 @@ class EntropyLoggingSAC(SAC):
 
             # Action by the current actor for the sampled state
             # actions_pi, entropy, _ = self.actor.action_entropy(replay_data.observations, log_ent_metrics=False)
-            actions_pi, entropy, _ = self.policy.action_entropy(
-                observation=replay_data.observations, deterministic=False, log_ent_metrics=False, compute_entropy=True
-            )
-            entropy = entropy.reshape(-1, 1)
+            with self._amp_autocast():
+                actions_pi, entropy, _ = self.policy.action_entropy(
+                    observation=replay_data.observations, deterministic=False, log_ent_metrics=False,
+                    compute_entropy=True
+                )
+                entropy = entropy.reshape(-1, 1)
             actor_ent_log.append(entropy.mean().item())
 
             ent_coef_loss = None
@@ -298,7 +387,7 @@ class EntropyLoggingSAC(SAC):
                 ent_coef_loss.backward()
                 self.ent_coef_optimizer.step()
 
-            with th.no_grad():
+            with th.no_grad(), self._amp_autocast():
                 # Select action according to policy
                 next_actions, next_entropy, _ = self.policy.action_entropy(
                     observation=replay_data.next_observations,
@@ -314,16 +403,18 @@ class EntropyLoggingSAC(SAC):
                 # td error + entropy term
                 target_q_values = replay_data.rewards + (1 - replay_data.dones) * self.gamma * next_q_values
 
-            # Get current Q-values estimates for each critic network
-            # using action from the replay buffer
-            current_q_values = self.critic(replay_data.observations, replay_data.actions)
-            q_values = th.cat(current_q_values, dim=1)
-            q_values, _ = th.min(q_values, dim=1, keepdim=True)
-            critic_values.append(q_values.mean().item())
+            with self._amp_autocast():
+                # Get current Q-values estimates for each critic network
+                # using action from the replay buffer
+                current_q_values = self.critic(replay_data.observations, replay_data.actions)
+                q_values = th.cat(current_q_values, dim=1)
+                q_values, _ = th.min(q_values, dim=1, keepdim=True)
+                critic_values.append(q_values.mean().item())
 
-            # Compute critic loss
-            critic_loss = 0.5 * sum([F.mse_loss(current_q, target_q_values) for current_q in current_q_values])
-            critic_losses.append(critic_loss.item())
+                # Compute critic loss
+                # mse_loss is on autocast's fp32 list, so the fp32 targets stay at full precision
+                critic_loss = 0.5 * sum([F.mse_loss(current_q, target_q_values) for current_q in current_q_values])
+                critic_losses.append(critic_loss.item())
 
             # Optimize the critic
             self.critic.optimizer.zero_grad()
@@ -333,10 +424,11 @@ class EntropyLoggingSAC(SAC):
             # Compute actor loss
             # Alternative: actor_loss = th.mean(entropy - qf1_pi)
             # Mean over all critic networks
-            q_values_pi = th.cat(self.critic(replay_data.observations, actions_pi), dim=1)
-            min_qf_pi, _ = th.min(q_values_pi, dim=1, keepdim=True)
-            actor_loss = -(ent_coef * entropy + min_qf_pi).mean()
-            actor_losses.append(actor_loss.item())
+            with self._amp_autocast():
+                q_values_pi = th.cat(self.critic(replay_data.observations, actions_pi), dim=1)
+                min_qf_pi, _ = th.min(q_values_pi, dim=1, keepdim=True)
+                actor_loss = -(ent_coef * entropy + min_qf_pi).mean()
+                actor_losses.append(actor_loss.item())
 
             # Optimize the actor
             self.actor.optimizer.zero_grad()
@@ -454,6 +546,92 @@ class CspnCallback(BaseCallback):
         pass
 
 
+class ThrottledLogger(Logger):
+    """
+    Logger that writes to an output format only on every n-th dump. The human-readable
+    stdout format is by far the most expensive one — it pretty-prints and pads every
+    logged key — while csv and tensorboard write cheaply, so with a tight log_interval the
+    stdout format can be throttled without losing any data.
+
+    :param dump_every: Maps output format class names to "write every n-th dump".
+        Formats not listed write on every dump.
+    """
+    def __init__(self, folder: Optional[str], output_formats: List[KVWriter], dump_every: Dict[str, int] = None):
+        super(ThrottledLogger, self).__init__(folder=folder, output_formats=output_formats)
+        self.dump_every = dump_every if dump_every is not None else {}
+        self._nr_of_dumps = 0
+
+    def dump(self, step: int = 0) -> None:
+        if self.level == DISABLED:
+            return
+        for _format in self.output_formats:
+            if isinstance(_format, KVWriter):
+                if self._nr_of_dumps % self.dump_every.get(type(_format).__name__, 1) == 0:
+                    _format.write(self.name_to_value, self.name_to_excluded, step)
+        self._nr_of_dumps += 1
+        self.name_to_value.clear()
+        self.name_to_count.clear()
+        self.name_to_excluded.clear()
+
+
+def configure_throttled_logger(folder: str, format_strings: List[str], stdout_every: int = 100) -> ThrottledLogger:
+    """Like stable_baselines3's configure(), but the stdout format only writes every stdout_every-th dump."""
+    os.makedirs(folder, exist_ok=True)
+    output_formats = [make_output_format(format_string, folder) for format_string in format_strings]
+    return ThrottledLogger(folder=folder, output_formats=output_formats,
+                           dump_every={'HumanOutputFormat': stdout_every})
+
+
+class VideoRecorderCallback(BaseCallback):
+    """
+    Records a video of the current policy on a separate eval env every ``render_freq``
+    calls to ``env.step()``. Keeping the recorder off the training env means the training
+    rollout never pays for render calls and frame encoding.
+
+    :param eval_env: A VecEnv that is only stepped for recording, wrapped identically to
+        the training envs
+    :param video_folder: Folder the videos are written to
+    :param render_freq: Record every render_freq steps
+    :param video_length: Number of frames per video
+    :param sync_obs_norm: Copy the observation normalization statistics from the training
+        env into the eval env before each recording
+    :param verbose: (int) Verbosity level 0: not output 1: info 2: debug
+    """
+    def __init__(self, eval_env: VecEnv, video_folder: str, render_freq: int, video_length: int = 1000,
+                 sync_obs_norm: bool = False, verbose=0):
+        super(VideoRecorderCallback, self).__init__(verbose)
+        self.eval_env = eval_env
+        self.video_folder = video_folder
+        self.render_freq = render_freq
+        self.video_length = video_length
+        self.sync_obs_norm = sync_obs_norm
+
+    def _on_step(self) -> bool:
+        if self.n_calls % self.render_freq == 0:
+            self.record_video()
+        return True
+
+    def record_video(self) -> None:
+        if self.sync_obs_norm:
+            # The eval env is only stepped for recordings, so its running statistics would
+            # stay cold; the policy expects the statistics the training envs converged to
+            mean, var, count = self.training_env.env_method('get_obs_norm_stats', indices=0)[0]
+            self.eval_env.env_method('set_obs_norm_stats', mean, var, count)
+        vid_env = VecVideoRecorder(
+            self.eval_env,
+            video_folder=self.video_folder,
+            record_video_trigger=lambda x: x == 0,
+            video_length=self.video_length,
+            name_prefix=f"rl-video-step-{self.num_timesteps}",
+        )
+        obs = vid_env.reset()
+        for _ in range(self.video_length):
+            action, _ = self.model.predict(obs, deterministic=True)
+            obs, _, _, _ = vid_env.step(action)
+        # Only the recorder is closed, the eval env is reused for the next video
+        vid_env.close_video_recorder()
+
+
 class CheckpointCallbackSaveReplayBuffer(CheckpointCallback):
     """
     Callback for saving a model every ``save_freq`` calls
@@ -468,11 +646,14 @@ class CheckpointCallbackSaveReplayBuffer(CheckpointCallback):
     :param save_freq:
     :param save_path: Path to the folder where the model will be saved.
     :param name_prefix: Common prefix to the saved models
+    :param save_obs_norm_stats: Also save the envs' observation normalization statistics,
+        so a resumed run does not restart them from scratch.
     :param verbose:
     """
-    def __init__(self, *args, stop_after_nr_of_saves=None, **kwargs):
+    def __init__(self, *args, stop_after_nr_of_saves=None, save_obs_norm_stats=False, **kwargs):
         super(CheckpointCallbackSaveReplayBuffer, self).__init__(*args, **kwargs)
         self.__stop_after_nr_of_saves = stop_after_nr_of_saves
+        self.__save_obs_norm_stats = save_obs_norm_stats
         self.__nr_of_saves = 0
 
     def _on_step(self) -> bool:
@@ -491,6 +672,15 @@ class CheckpointCallbackSaveReplayBuffer(CheckpointCallback):
                                       f"didn't exist!")
                     break
             self.model.save_replay_buffer(os.path.join(self.save_path, f"replay_buffer_{self.num_timesteps}_steps.pkl"))
+            if self.__save_obs_norm_stats:
+                for f in os.listdir(self.save_path):
+                    if f.startswith('obs_norm_stats'):
+                        os.remove(os.path.join(self.save_path, f))
+                        break
+                stats = self.training_env.env_method('get_obs_norm_stats')
+                means, variances, counts = zip(*stats)
+                np.savez(os.path.join(self.save_path, f"obs_norm_stats_{self.num_timesteps}_steps.npz"),
+                         mean=np.stack(means), var=np.stack(variances), count=np.array(counts))
             self.__nr_of_saves += 1
         if self.__stop_after_nr_of_saves is None:
             return True
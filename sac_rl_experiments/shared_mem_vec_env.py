@@ -0,0 +1,201 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import Any, Callable, List, Optional, Sequence, Type, Union
+
+import gym
+import numpy as np
+
+from stable_baselines3.common.env_util import is_wrapped
+from stable_baselines3.common.vec_env.base_vec_env import (
+    CloudpickleWrapper,
+    VecEnv,
+    VecEnvIndices,
+    VecEnvObs,
+    VecEnvStepReturn,
+)
+
+
+def _shm_worker(remote, parent_remote, env_fn_wrapper, shm_names, obs_shape, obs_dtype, n_envs, index) -> None:
+    parent_remote.close()
+    env = env_fn_wrapper.var()
+    obs_shm = shared_memory.SharedMemory(name=shm_names[0])
+    rew_shm = shared_memory.SharedMemory(name=shm_names[1])
+    done_shm = shared_memory.SharedMemory(name=shm_names[2])
+    obs_buf = np.ndarray((n_envs,) + obs_shape, dtype=obs_dtype, buffer=obs_shm.buf)
+    rew_buf = np.ndarray((n_envs,), dtype=np.float32, buffer=rew_shm.buf)
+    done_buf = np.ndarray((n_envs,), dtype=np.bool_, buffer=done_shm.buf)
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                observation, reward, done, info = env.step(data)
+                if done:
+                    # save final observation where user can get it, then reset
+                    info["terminal_observation"] = observation
+                    observation = env.reset()
+                obs_buf[index] = observation
+                rew_buf[index] = reward
+                done_buf[index] = done
+                remote.send(info)
+            elif cmd == "reset":
+                obs_buf[index] = env.reset()
+                remote.send(None)
+            elif cmd == "seed":
+                remote.send(env.seed(data))
+            elif cmd == "render":
+                remote.send(env.render(data))
+            elif cmd == "close":
+                env.close()
+                obs_shm.close()
+                rew_shm.close()
+                done_shm.close()
+                remote.close()
+                break
+            elif cmd == "get_attr":
+                remote.send(getattr(env, data))
+            elif cmd == "set_attr":
+                remote.send(setattr(env, data[0], data[1]))
+            elif cmd == "env_method":
+                method = getattr(env, data[0])
+                remote.send(method(*data[1], **data[2]))
+            elif cmd == "is_wrapped":
+                remote.send(is_wrapped(env, data))
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+        except EOFError:
+            break
+
+
+class SharedMemVecEnv(VecEnv):
+    """
+    A SubprocVecEnv variant that transports observations, rewards and dones through
+    preallocated multiprocessing.shared_memory blocks instead of pickling them through the
+    worker pipes. Each worker writes its slot of the shared arrays in place; only the
+    (small) info dicts still travel through the pipes. This removes the per-step
+    pickle/unpickle and pipe copies, leaving one driver-side memcpy per batch.
+
+    Requires a Box observation space of fixed shape, which is the case for all envs this
+    project trains on.
+
+    :param env_fns: Environments to run in subprocesses
+    :param start_method: method used to start the subprocesses, see SubprocVecEnv
+    """
+
+    def __init__(self, env_fns: List[Callable[[], gym.Env]], start_method: Optional[str] = None):
+        self.waiting = False
+        self.closed = False
+        n_envs = len(env_fns)
+
+        if start_method is None:
+            # Fork is not a thread safe method (see issue #217)
+            # but is more user friendly (does not require to wrap the code in
+            # a `if __name__ == "__main__":`)
+            forkserver_available = "forkserver" in mp.get_all_start_methods()
+            start_method = "forkserver" if forkserver_available else "spawn"
+        ctx = mp.get_context(start_method)
+
+        # The spaces are probed on a throwaway env in the driver, as the shared arrays must
+        # exist before the workers start.
+        probe_env = env_fns[0]()
+        observation_space, action_space = probe_env.observation_space, probe_env.action_space
+        probe_env.close()
+        assert isinstance(observation_space, gym.spaces.Box), \
+            "SharedMemVecEnv requires a Box observation space of fixed shape."
+        VecEnv.__init__(self, n_envs, observation_space, action_space)
+
+        obs_dtype = np.dtype(observation_space.dtype)
+        obs_shape = observation_space.shape
+        self._obs_shm = shared_memory.SharedMemory(
+            create=True, size=max(1, n_envs * int(np.prod(obs_shape)) * obs_dtype.itemsize)
+        )
+        self._rew_shm = shared_memory.SharedMemory(create=True, size=n_envs * np.dtype(np.float32).itemsize)
+        self._done_shm = shared_memory.SharedMemory(create=True, size=n_envs * np.dtype(np.bool_).itemsize)
+        self._obs_buf = np.ndarray((n_envs,) + obs_shape, dtype=obs_dtype, buffer=self._obs_shm.buf)
+        self._rew_buf = np.ndarray((n_envs,), dtype=np.float32, buffer=self._rew_shm.buf)
+        self._done_buf = np.ndarray((n_envs,), dtype=np.bool_, buffer=self._done_shm.buf)
+
+        shm_names = (self._obs_shm.name, self._rew_shm.name, self._done_shm.name)
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(n_envs)])
+        self.processes = []
+        for index, (work_remote, remote, env_fn) in enumerate(zip(self.work_remotes, self.remotes, env_fns)):
+            args = (work_remote, remote, CloudpickleWrapper(env_fn), shm_names, obs_shape, obs_dtype.str, n_envs, index)
+            # daemon=True: if the main process crashes, we should not cause things to hang
+            process = ctx.Process(target=_shm_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+    def step_async(self, actions: np.ndarray) -> None:
+        for remote, action in zip(self.remotes, actions):
+            remote.send(("step", action))
+        self.waiting = True
+
+    def step_wait(self) -> VecEnvStepReturn:
+        infos = [remote.recv() for remote in self.remotes]
+        self.waiting = False
+        # The shared arrays are overwritten by the next step, so the caller gets copies
+        return self._obs_buf.copy(), self._rew_buf.copy(), self._done_buf.copy(), infos
+
+    def seed(self, seed: Optional[int] = None) -> List[Union[None, int]]:
+        for idx, remote in enumerate(self.remotes):
+            remote.send(("seed", seed + idx))
+        return [remote.recv() for remote in self.remotes]
+
+    def reset(self) -> VecEnvObs:
+        for remote in self.remotes:
+            remote.send(("reset", None))
+        for remote in self.remotes:
+            remote.recv()
+        return self._obs_buf.copy()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            remote.send(("close", None))
+        for process in self.processes:
+            process.join()
+        for shm in [self._obs_shm, self._rew_shm, self._done_shm]:
+            shm.close()
+            shm.unlink()
+        self.closed = True
+
+    def get_images(self) -> Sequence[np.ndarray]:
+        for pipe in self.remotes:
+            # gather images from subprocesses
+            # `mode` will be taken into account later
+            pipe.send(("render", "rgb_array"))
+        imgs = [pipe.recv() for pipe in self.remotes]
+        return imgs
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> List[Any]:
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(("get_attr", attr_name))
+        return [remote.recv() for remote in target_remotes]
+
+    def set_attr(self, attr_name: str, value: Any, indices: VecEnvIndices = None) -> None:
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(("set_attr", (attr_name, value)))
+        for remote in target_remotes:
+            remote.recv()
+
+    def env_method(self, method_name: str, *method_args, indices: VecEnvIndices = None, **method_kwargs) -> List[Any]:
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(("env_method", (method_name, method_args, method_kwargs)))
+        return [remote.recv() for remote in target_remotes]
+
+    def env_is_wrapped(self, wrapper_class: Type[gym.Wrapper], indices: VecEnvIndices = None) -> List[bool]:
+        target_remotes = self._get_target_remotes(indices)
+        for remote in target_remotes:
+            remote.send(("is_wrapped", wrapper_class))
+        return [remote.recv() for remote in target_remotes]
+
+    def _get_target_remotes(self, indices: VecEnvIndices) -> List[Any]:
+        indices = self._get_indices(indices)
+        return [self.remotes[i] for i in indices]
@@ -0,0 +1,94 @@
+import gym
+import numpy as np
+
+from stable_baselines3.common.logger import KVWriter
+
+from sac_rl_experiments.joint_failure_wrapper import FloatWrapper
+from sac_rl_experiments.sb3 import SumTreeReplayBuffer, ThrottledLogger
+
+
+def filled_sum_tree_buffer(n_transitions: int, buffer_size: int = 8) -> SumTreeReplayBuffer:
+    obs_space = gym.spaces.Box(low=-np.inf, high=np.inf, shape=(1,), dtype=np.float32)
+    act_space = gym.spaces.Box(low=-1.0, high=1.0, shape=(1,), dtype=np.float32)
+    buffer = SumTreeReplayBuffer(buffer_size, obs_space, act_space, device='cpu')
+    for i in range(n_transitions):
+        # The observation holds the buffer row, so sampled rows can be read back off the batch
+        obs = np.array([[float(i)]], dtype=np.float32)
+        buffer.add(obs, obs, np.zeros((1, 1), dtype=np.float32), np.zeros(1, dtype=np.float32),
+                   np.zeros(1, dtype=np.float32), [{}])
+    return buffer
+
+
+def sampled_frequencies(buffer: SumTreeReplayBuffer, n_rows: int, n_samples: int = 20000) -> np.ndarray:
+    samples = buffer.sample(n_samples)
+    rows = samples.observations.numpy().flatten().astype(np.int64)
+    return np.bincount(rows, minlength=n_rows) / n_samples
+
+
+def test_sampling_is_uniform_before_priority_updates():
+    np.random.seed(0)
+    buffer = filled_sum_tree_buffer(n_transitions=8)
+    freqs = sampled_frequencies(buffer, n_rows=8)
+    assert np.abs(freqs - 1 / 8).max() < 0.02
+
+
+def test_sampled_frequencies_track_priorities():
+    np.random.seed(0)
+    buffer = filled_sum_tree_buffer(n_transitions=8)
+    priorities = np.arange(1.0, 9.0)
+    buffer.update_priorities(np.arange(8), priorities)
+    freqs = sampled_frequencies(buffer, n_rows=8)
+    assert np.abs(freqs - priorities / priorities.sum()).max() < 0.02
+
+
+def test_zero_priority_rows_are_not_sampled():
+    np.random.seed(0)
+    buffer = filled_sum_tree_buffer(n_transitions=8)
+    buffer.update_priorities(np.arange(8), np.array([0.0, 1.0, 0.0, 1.0, 0.0, 1.0, 0.0, 1.0]))
+    freqs = sampled_frequencies(buffer, n_rows=8)
+    assert freqs[::2].sum() == 0.0
+
+
+def test_partially_filled_buffer_only_samples_stored_rows():
+    np.random.seed(0)
+    buffer = filled_sum_tree_buffer(n_transitions=3)
+    freqs = sampled_frequencies(buffer, n_rows=8)
+    assert freqs[3:].sum() == 0.0
+
+
+def test_float_wrapper_emits_float32():
+    env = FloatWrapper(gym.make('Pendulum-v1'))
+    assert env.observation_space.dtype == np.float32
+    obs = env.reset()
+    assert obs.dtype == np.float32
+    obs, _, _, _ = env.step(env.action_space.sample())
+    assert obs.dtype == np.float32
+
+
+class CountingWriter(KVWriter):
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, key_values, key_excluded, step=0):
+        self.writes += 1
+
+    def close(self):
+        pass
+
+
+class ThrottledCountingWriter(CountingWriter):
+    pass
+
+
+def test_throttled_logger_dump_cadence():
+    unthrottled = CountingWriter()
+    throttled = ThrottledCountingWriter()
+    logger = ThrottledLogger(folder=None, output_formats=[unthrottled, throttled],
+                             dump_every={'ThrottledCountingWriter': 5})
+    for step in range(20):
+        logger.record('key', step)
+        logger.dump(step)
+    assert unthrottled.writes == 20
+    assert throttled.writes == 4
+    # A dump clears the collected values even for formats that skipped it
+    assert len(logger.name_to_value) == 0